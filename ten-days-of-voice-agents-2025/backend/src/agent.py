@@ -1,11 +1,23 @@
+import asyncio
 import logging
 import os
-import json
+import pickle
+import re
+import threading
+import time
+from dataclasses import dataclass, fields
 from pathlib import Path
-from datetime import datetime
-from typing import List, Dict, Any, Annotated
+from typing import Annotated, Any, Optional
 
+import ijson
+import orjson
 from dotenv import load_dotenv
+from rapidfuzz import fuzz, process, utils
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to unlocked appends
+    fcntl = None
 
 from livekit.agents import (
     Agent,
@@ -16,11 +28,11 @@ from livekit.agents import (
     RoomInputOptions,
     WorkerOptions,
     cli,
+    function_tool,
     metrics,
     tokenize,
-    function_tool,
 )
-from livekit.plugins import murf, silero, google, deepgram, noise_cancellation
+from livekit.plugins import deepgram, google, murf, noise_cancellation, silero
 from livekit.plugins.turn_detector.multilingual import MultilingualModel
 
 logger = logging.getLogger("day9-agent")
@@ -34,108 +46,370 @@ load_dotenv(".env.local")
 
 BASE_DIR = Path(__file__).parent
 CATALOG_FILE = BASE_DIR / "catalog.json"
-ORDERS_FILE = BASE_DIR / "orders.json"
+CATALOG_CACHE_FILE = BASE_DIR / "catalog.pkl"
+ORDERS_FILE = BASE_DIR / "orders.jsonl"
+LEGACY_ORDERS_FILE = BASE_DIR / "orders.json"
+
+# Cap on products returned per search, to keep LLM and TTS output short
+MAX_RESULTS = 10
+
+
+def _migrate_legacy_orders():
+    """Copy orders.json into the journal, streaming it one order at a time."""
+    # Write to a temp file and rename so a crash never leaves a half-written journal
+    tmp = ORDERS_FILE.with_suffix(".jsonl.tmp")
+    with open(tmp, "wb") as out:
+        if LEGACY_ORDERS_FILE.exists():
+            with open(LEGACY_ORDERS_FILE, "rb") as f:
+                for order in ijson.items(f, "item", use_float=True):
+                    out.write(orjson.dumps(order) + b"\n")
+    os.replace(tmp, ORDERS_FILE)
+
 
-# Ensure orders.json exists
+# Ensure the orders journal exists, carrying over any legacy orders.json
 if not ORDERS_FILE.exists():
-    with open(ORDERS_FILE, "w") as f:
-        json.dump([], f)
+    _migrate_legacy_orders()
 
 
 def load_catalog():
-    with open(CATALOG_FILE, "r") as f:
-        return json.load(f)
+    return orjson.loads(CATALOG_FILE.read_bytes())
+
+
+@dataclass(frozen=True)
+class Product:
+    """A catalog entry with its search text precomputed at load time."""
+
+    __slots__ = (
+        "category",
+        "color",
+        "currency",
+        "description",
+        "haystack",
+        "id",
+        "name",
+        "price",
+        "sizes",
+    )
+
+    id: str
+    name: str
+    description: str
+    price: int
+    currency: str
+    category: str
+    color: str
+    sizes: tuple[str, ...]
+    haystack: str
+
+    @classmethod
+    def from_dict(cls, raw: dict[str, Any]) -> "Product":
+        color = raw.get("color", "")
+        return cls(
+            id=raw["id"],
+            name=raw["name"],
+            description=raw["description"],
+            price=raw["price"],
+            currency=raw.get("currency", "INR"),
+            category=raw["category"],
+            color=color,
+            sizes=tuple(raw.get("sizes", ())),
+            haystack=f"{raw['name']} {raw['description']} {raw['category']} {color}".lower(),
+        )
+
+    def __reduce__(self):
+        # Frozen slots can't be restored by pickle's default setattr path.
+        # Rebuild in field order, which need not match the __slots__ order.
+        return (Product, tuple(getattr(self, f.name) for f in fields(self)))
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def build_index(catalog: list[Product]) -> dict[str, set[int]]:
+    """Inverted index: token -> positions of the products containing it."""
+    index: dict[str, set[int]] = {}
+    for i, p in enumerate(catalog):
+        for tok in _tokenize(p.haystack):
+            index.setdefault(tok, set()).add(i)
+    return index
+
+
+# Bump when Product or the index layout changes to invalidate old snapshots
+CATALOG_CACHE_VERSION = 1
+
+
+def load_catalog_tables() -> tuple[list[Product], dict[str, set[int]]]:
+    """Return the catalog and its index, from the pickled snapshot when fresh.
+
+    The snapshot is keyed on catalog.json's mtime and size, so editing the
+    catalog rebuilds it on the next start.
+    """
+    st = CATALOG_FILE.stat()
+    key = (st.st_mtime_ns, st.st_size, CATALOG_CACHE_VERSION)
+    try:
+        with open(CATALOG_CACHE_FILE, "rb") as f:
+            if pickle.load(f) == key:
+                return pickle.load(f)
+    except Exception:
+        pass  # missing or unreadable snapshot, rebuild it below
+
+    catalog = [Product.from_dict(raw) for raw in load_catalog()]
+    index = build_index(catalog)
+    try:
+        # Per-process temp name so concurrently starting workers don't collide
+        tmp = CATALOG_CACHE_FILE.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump((catalog, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, CATALOG_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"Could not write catalog cache: {e}")
+    return catalog, index
+
+
+# The catalog is static for the lifetime of the worker. These are filled
+# once per process by warm_catalog(), normally from prewarm().
+CATALOG: list[Product] = []
+CATALOG_BY_ID: dict[str, Product] = {}
+INDEX: dict[str, set[int]] = {}
+CATALOG_NAMES: list[str] = []
+
+# Minimum WRatio score (0-100) for a fuzzy product-name match
+FUZZY_CUTOFF = 75
+# Runners-up this close to the best score make a fuzzy match ambiguous
+FUZZY_MARGIN = 5
+
 
+def warm_catalog():
+    """Parse the catalog and build its lookup tables if not done yet."""
+    global CATALOG, CATALOG_BY_ID, INDEX, CATALOG_NAMES
 
-def load_orders():
-    with open(ORDERS_FILE, "r") as f:
-        return json.load(f)
+    if not CATALOG:
+        catalog, INDEX = load_catalog_tables()
+        CATALOG_BY_ID = {p.id: p for p in catalog}
+        CATALOG_NAMES = [p.name for p in catalog]
+        CATALOG = catalog
 
 
-def save_orders(data):
-    with open(ORDERS_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+# Serializes saves from worker threads within this process
+_SAVE_LOCK = threading.Lock()
+
+
+def _catch_up(unseen: bytes):
+    """Account for complete journal lines other workers appended past our offset."""
+    global _ORDER_COUNT, _LAST_ORDER, _JOURNAL_OFFSET
+
+    # A line still being written by another worker is left for next time
+    complete = unseen[: unseen.rfind(b"\n") + 1]
+    if complete.strip():
+        _ORDER_COUNT += complete.count(b"\n")
+        _LAST_ORDER = orjson.loads(complete.rstrip().rsplit(b"\n", 1)[-1])
+    _JOURNAL_OFFSET += len(complete)
+
+
+def save_order(order):
+    """Assign the next order id and append the order to the journal.
+
+    Several worker processes may share the journal, so the append runs under
+    an exclusive lock and first catches up on orders other workers wrote.
+    Blocking; async callers should run it via asyncio.to_thread.
+    """
+    global _ORDER_COUNT, _LAST_ORDER, _JOURNAL_OFFSET
+
+    with _SAVE_LOCK, open(ORDERS_FILE, "ab+") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            f.seek(_JOURNAL_OFFSET)
+            _catch_up(f.read())
+
+            _ORDER_COUNT += 1
+            order["id"] = f"ord-{_ORDER_COUNT}"
+            line = orjson.dumps(order) + b"\n"
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            _JOURNAL_OFFSET += len(line)
+            _LAST_ORDER = order
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def read_last_order():
+    """Return the final journal entry by scanning backwards from EOF."""
+    with open(ORDERS_FILE, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b""
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            tail = buf.rstrip()
+            nl = tail.rfind(b"\n")
+            if nl != -1:
+                return orjson.loads(tail[nl + 1 :])
+        buf = buf.strip()
+        return orjson.loads(buf) if buf else None
+
+
+# Order ids are sequential; count the journal once instead of per order.
+# _JOURNAL_OFFSET marks how much of the journal this process has seen.
+_journal = ORDERS_FILE.read_bytes()
+_ORDER_COUNT = _journal.count(b"\n")
+_JOURNAL_OFFSET = len(_journal)
+del _journal
+
+# Most recent order, kept in memory; get_last_order only stats the journal
+_LAST_ORDER: Optional[dict[str, Any]] = read_last_order()
+
+
+def search_index(query: str) -> list[Product]:
+    """Products containing every word of the query, from the index alone."""
+    tokens = _tokenize(query)
+    postings = [INDEX.get(t) for t in tokens]
+    if not tokens or not all(postings):
+        return []
+    return [CATALOG[i] for i in sorted(set.intersection(*postings))]
 
 
 def list_catalog(query: str = ""):
+    warm_catalog()
     query = query.lower().strip()
-    catalog = load_catalog()
     if not query:
-        return catalog
-
-    results = []
-    for p in catalog:
-        haystack = f"{p['name']} {p['description']} {p['category']} {p.get('color','')}".lower()
-        if query in haystack:
-            results.append(p)
+        return CATALOG
 
-    return results
+    hits = search_index(query)
+    if hits:
+        return hits
 
+    # Partial words ("hood", "bott") are not indexed; fall back to a scan
+    return [p for p in CATALOG if query in p.haystack]
 
-def create_new_order(items: List[Dict[str, Any]]):
-    catalog = load_catalog()
-    orders = load_orders()
 
-    resolved_items = []
-    total_cost = 0
+def match_product_names(names: list[str]) -> list[list[Product]]:
+    """Fuzzy-match spoken or misheard product names against the catalog.
 
+    All names are scored against the catalog in a single rapidfuzz call.
+    Each name gets every product scoring within FUZZY_MARGIN of its best
+    match, so a single candidate means the match is unique.
+    """
+    scores = process.cdist(
+        names,
+        CATALOG_NAMES,
+        scorer=fuzz.WRatio,
+        processor=utils.default_process,
+        score_cutoff=FUZZY_CUTOFF,
+    )
+    matches: list[list[Product]] = []
+    for row in scores:
+        best = row.max()
+        # Scores under the cutoff come back as 0
+        if not best:
+            matches.append([])
+            continue
+        close = (row >= best - FUZZY_MARGIN).nonzero()[0]
+        # Best match first, ties kept in catalog order
+        matches.append([CATALOG[int(j)] for j in sorted(close, key=lambda j: -row[j])])
+    return matches
+
+
+def build_order(items: list[dict[str, Any]]):
+    """Resolve items against the catalog into an unsaved order (no id yet)."""
+    warm_catalog()
+    resolved: list[Optional[Product]] = []
+    misses: list[tuple[int, str]] = []
+
+    # First pass: validate items and resolve exact catalog ids
     for it in items:
         # Handle various key names the LLM might use
         pid = it.get("product_id") or it.get("id") or it.get("name")
         if not pid:
-            return {"error": f"Invalid item format: {it}. Must contain product_id, id, or name."}
-        
-        qty = it.get("quantity", 1)
+            return {
+                "error": f"Invalid item format: {it}. Must contain product_id, id, or name."
+            }
 
-        product = next((p for p in catalog if p["id"] == pid), None)
+        product = CATALOG_BY_ID.get(pid)
         if not product:
-            # Try finding by name or fuzzy search
-            candidates = list_catalog(pid)
-            if len(candidates) == 1:
-                product = candidates[0]
-            elif len(candidates) > 1:
-                return {"error": f"Product '{pid}' is ambiguous. Found: {', '.join(c['name'] for c in candidates)}"}
-            else:
+            misses.append((len(resolved), pid))
+        resolved.append(product)
+
+    # Second pass: index lookups settle whole-word names, and report names
+    # matching several products as ambiguous rather than guessing. No
+    # per-item catalog scan; everything else goes to the batched fuzzy pass.
+    unmatched: list[tuple[int, str]] = []
+    for i, pid in misses:
+        candidates = search_index(pid)
+        if len(candidates) == 1:
+            resolved[i] = candidates[0]
+        elif len(candidates) > 1:
+            return {
+                "error": f"Product '{pid}' is ambiguous. Found: {', '.join(c.name for c in candidates)}"
+            }
+        else:
+            unmatched.append((i, pid))
+
+    # Third pass: fuzzy-match the rest (typos, STT noise) in one batch
+    if unmatched:
+        matches = match_product_names([pid for _, pid in unmatched])
+        for (i, pid), candidates in zip(unmatched, matches):
+            if len(candidates) > 1:
+                return {
+                    "error": f"Product '{pid}' is ambiguous. Found: {', '.join(c.name for c in candidates)}"
+                }
+            if not candidates:
                 return {"error": f"Product '{pid}' not found"}
+            resolved[i] = candidates[0]
 
-        resolved_items.append({
-            "product_id": product["id"],
-            "name": product["name"],
-            "quantity": qty,
-            "unit_price": product["price"]
-        })
+    resolved_items = []
+    total_cost = 0
+
+    for it, product in zip(items, resolved):
+        qty = it.get("quantity", 1)
 
-        total_cost += product["price"] * qty
+        resolved_items.append(
+            {
+                "product_id": product.id,
+                "name": product.name,
+                "quantity": qty,
+                "unit_price": product.price,
+            }
+        )
+
+        total_cost += product.price * qty
 
     order = {
-        "id": f"ord-{len(orders)+1}",
-        "created_at": datetime.now().isoformat(),
+        "id": None,  # assigned by save_order
+        "created_at": time.time_ns() // 1_000_000,  # epoch milliseconds
         "items": resolved_items,
         "total_amount": total_cost,
-        "currency": "INR"
+        "currency": "INR",
     }
-
-    orders.append(order)
-    save_orders(orders)
     return order
 
 
 def last_order():
-    orders = load_orders()
-    if not orders:
-        return None
-    return orders[-1]
+    # Another worker may have taken an order since; one stat call tells us
+    if ORDERS_FILE.stat().st_size > _JOURNAL_OFFSET:
+        with _SAVE_LOCK, open(ORDERS_FILE, "rb") as f:
+            f.seek(_JOURNAL_OFFSET)
+            _catch_up(f.read())
+    return _LAST_ORDER
 
 
 # ============================================================
 # AGENT IMPLEMENTATION
 # ============================================================
 
+
 class Assistant(Agent):
     def __init__(self) -> None:
-        super().__init__(
-            instructions=self._prompt()
-        )
+        super().__init__(instructions=self._prompt())
 
     def _prompt(self):
         return """
@@ -143,7 +417,8 @@ You are LYRA — a premium, calm, Apple-store-style shopping assistant.
 
 Your tasks:
 1. Let users browse products via voice.
-2. Call list_products() when the user searches for an item.
+2. Call list_products() when the user searches for an item. Prices are in INR.
+   If the result has "more", ask the user to narrow their search.
 3. Call create_order() when the user buys something.
 4. Call get_last_order() when they ask what they purchased.
 5. NEVER invent products. Only respond using function tool results.
@@ -160,23 +435,34 @@ Your tasks:
         if not data:
             return "No products found matching your search."
 
-        out = "Here are some products:\n"
-        for p in data:
-            out += f"- {p['name']} (ID: {p['id']}) — ₹{p['price']}\n"
-        return out
+        # Compact structured result: fewer tokens for the LLM to read back
+        result: dict[str, Any] = {
+            "products": [
+                {"id": p.id, "name": p.name, "price": p.price}
+                for p in data[:MAX_RESULTS]
+            ]
+        }
+        if len(data) > MAX_RESULTS:
+            result["more"] = len(data) - MAX_RESULTS
+        return result
 
     @function_tool
-    async def create_order(self, items: Annotated[List[Dict[str, Any]], "Items to purchase"]):
+    async def create_order(
+        self, items: Annotated[list[dict[str, Any]], "Items to purchase"]
+    ):
         try:
             logger.info(f"create_order called with: {items}")
-            order = create_new_order(items)
+            order = build_order(items)
             if "error" in order:
                 return f"Order failed: {order['error']}"
 
+            # Keep the journal write (lock + fsync) off the event loop
+            await asyncio.to_thread(save_order, order)
+
             return f"Order placed! ID: {order['id']} — Total: ₹{order['total_amount']}."
         except Exception as e:
             logger.error(f"Error in create_order: {e}", exc_info=True)
-            return f"An error occurred while processing your order: {str(e)}"
+            return f"An error occurred while processing your order: {e!s}"
 
     @function_tool
     async def get_last_order(self):
@@ -192,14 +478,21 @@ Your tasks:
 # PREWARM
 # ============================================================
 
+
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    # Stateless tokenizer, built once and shared by every room. The turn
+    # detector binds to the job's inference executor, so it stays per-session.
+    proc.userdata["sentence_tok"] = tokenize.basic.SentenceTokenizer(min_sentence_len=2)
+    # Parse the catalog and build the search index before the first tool call
+    warm_catalog()
 
 
 # ============================================================
 # ENTRYPOINT
 # ============================================================
 
+
 async def entrypoint(ctx: JobContext):
     ctx.log_context_fields = {"room": ctx.room.name}
 
@@ -209,7 +502,7 @@ async def entrypoint(ctx: JobContext):
         tts=murf.TTS(
             voice="en-US-matthew",
             style="Conversation",
-            tokenizer=tokenize.basic.SentenceTokenizer(min_sentence_len=2),
+            tokenizer=ctx.proc.userdata["sentence_tok"],
             text_pacing=True,
         ),
         vad=ctx.proc.userdata["vad"],
@@ -241,8 +534,7 @@ async def entrypoint(ctx: JobContext):
     await ctx.connect()
 
     await session.say(
-        "Hello, I’m Lyra. What would you like to shop for today?",
-        add_to_chat_ctx=True
+        "Hello, I’m Lyra. What would you like to shop for today?", add_to_chat_ctx=True
     )
 
 
@@ -251,9 +543,4 @@ async def entrypoint(ctx: JobContext):
 # ============================================================
 
 if __name__ == "__main__":
-    cli.run_app(
-        WorkerOptions(
-            entrypoint_fnc=entrypoint,
-            prewarm_fnc=prewarm
-        )
-    )
+    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
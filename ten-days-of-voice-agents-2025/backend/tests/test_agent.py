@@ -108,3 +108,41 @@ async def test_refuses_harmful_request() -> None:
 
         # Ensures there are no function calls or other unexpected events
         result.expect.no_more_events()
+
+
+@pytest.mark.asyncio
+async def test_product_search_uses_catalog() -> None:
+    """Evaluation of the agent's ability to answer product searches from list_products."""
+    async with (
+        _llm() as llm,
+        AgentSession(llm=llm) as session,
+    ):
+        await session.start(Assistant())
+
+        # Run an agent turn following a product search from the user
+        result = await session.run(user_input="I'm looking for a hoodie.")
+
+        # The agent must look the product up rather than answer from memory
+        result.expect.next_event().is_function_call(name="list_products")
+        result.expect.next_event().is_function_call_output()
+
+        # Evaluate the agent's response against the returned products
+        await (
+            result.expect.next_event()
+            .is_message(role="assistant")
+            .judge(
+                llm,
+                intent="""
+                Offers the Black Premium Hoodie, priced at 1499 rupees (INR).
+
+                The response should not:
+                - Mention any other hoodie, brand, color or size option as available
+                - Quote a different price for the hoodie
+
+                Asking whether the user would like to order it is acceptable.
+                """,
+            )
+        )
+
+        # Ensures there are no further function calls or other unexpected events
+        result.expect.no_more_events()
@@ -0,0 +1,234 @@
+import os
+
+import orjson
+import pytest
+from rapidfuzz import fuzz, utils
+
+import agent
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """Point the orders journal at an empty file and reset the in-memory state."""
+    path = tmp_path / "orders.jsonl"
+    path.write_bytes(b"")
+    monkeypatch.setattr(agent, "ORDERS_FILE", path)
+    monkeypatch.setattr(agent, "_ORDER_COUNT", 0)
+    monkeypatch.setattr(agent, "_JOURNAL_OFFSET", 0)
+    monkeypatch.setattr(agent, "_LAST_ORDER", None)
+    return path
+
+
+def _journal_ids(path):
+    return [orjson.loads(line)["id"] for line in path.read_bytes().splitlines()]
+
+
+def test_save_order_assigns_sequential_ids(journal) -> None:
+    """Orders saved by one worker get consecutive ids."""
+    first, second = {"items": []}, {"items": []}
+    agent.save_order(first)
+    agent.save_order(second)
+
+    assert (first["id"], second["id"]) == ("ord-1", "ord-2")
+    assert _journal_ids(journal) == ["ord-1", "ord-2"]
+    assert agent.last_order() is second
+
+
+def test_save_order_catches_up_with_other_appenders(journal, monkeypatch) -> None:
+    """A worker that missed another worker's append continues the sequence."""
+    journal.write_bytes(b'{"id":"ord-1","items":[]}\n')
+    # This worker loaded the journal before another worker wrote ord-1
+    mine = {"items": []}
+    agent.save_order(mine)
+
+    assert mine["id"] == "ord-2"
+    assert _journal_ids(journal) == ["ord-1", "ord-2"]
+
+    # And the other worker, still at offset 0, catches up on ord-2
+    monkeypatch.setattr(agent, "_ORDER_COUNT", 0)
+    monkeypatch.setattr(agent, "_JOURNAL_OFFSET", 0)
+    theirs = {"items": []}
+    agent.save_order(theirs)
+
+    assert theirs["id"] == "ord-3"
+    assert _journal_ids(journal) == ["ord-1", "ord-2", "ord-3"]
+
+
+def test_read_last_order_empty_journal(journal) -> None:
+    assert agent.read_last_order() is None
+
+
+@pytest.mark.parametrize("pad", [0, 10_000])
+def test_read_last_order_without_trailing_newline(journal, pad) -> None:
+    """The final line is found even when unterminated or longer than a read chunk."""
+    last = {"id": "ord-2", "note": "x" * pad}
+    journal.write_bytes(b'{"id":"ord-1"}\n' + orjson.dumps(last))
+
+    assert agent.read_last_order() == last
+
+
+def test_migrate_legacy_orders(tmp_path, monkeypatch) -> None:
+    """orders.json is carried into the journal one order per line."""
+    legacy = [
+        {
+            "id": "ord-1",
+            "total_amount": 899,
+            "items": [{"name": "Bottle", "quantity": 1}],
+        },
+        {"id": "ord-2", "total_amount": 12.5, "items": []},
+    ]
+    legacy_file = tmp_path / "orders.json"
+    legacy_file.write_bytes(orjson.dumps(legacy, option=orjson.OPT_INDENT_2))
+    monkeypatch.setattr(agent, "ORDERS_FILE", tmp_path / "orders.jsonl")
+    monkeypatch.setattr(agent, "LEGACY_ORDERS_FILE", legacy_file)
+
+    agent._migrate_legacy_orders()
+
+    lines = (tmp_path / "orders.jsonl").read_bytes().splitlines()
+    assert [orjson.loads(line) for line in lines] == legacy
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_migrate_without_legacy_file_creates_empty_journal(
+    tmp_path, monkeypatch
+) -> None:
+    monkeypatch.setattr(agent, "ORDERS_FILE", tmp_path / "orders.jsonl")
+    monkeypatch.setattr(agent, "LEGACY_ORDERS_FILE", tmp_path / "orders.json")
+
+    agent._migrate_legacy_orders()
+
+    assert (tmp_path / "orders.jsonl").read_bytes() == b""
+
+
+def _product(pid: str, name: str) -> dict:
+    return {
+        "id": pid,
+        "name": name,
+        "description": "",
+        "price": 100,
+        "category": "misc",
+    }
+
+
+@pytest.fixture
+def catalog_file(tmp_path, monkeypatch):
+    """Point the catalog and its pickled snapshot at files under tmp_path."""
+    path = tmp_path / "catalog.json"
+    path.write_bytes(orjson.dumps([_product("mug-001", "Coffee Mug")]))
+    monkeypatch.setattr(agent, "CATALOG_FILE", path)
+    monkeypatch.setattr(agent, "CATALOG_CACHE_FILE", tmp_path / "catalog.pkl")
+    return path
+
+
+def test_catalog_snapshot_is_reused_while_fresh(catalog_file, monkeypatch) -> None:
+    catalog, index = agent.load_catalog_tables()
+    assert agent.CATALOG_CACHE_FILE.exists()
+
+    def _no_json():
+        raise AssertionError("catalog.json parsed despite a fresh snapshot")
+
+    monkeypatch.setattr(agent, "load_catalog", _no_json)
+    cached_catalog, cached_index = agent.load_catalog_tables()
+
+    assert cached_catalog == catalog
+    assert cached_index == index
+
+
+def test_catalog_snapshot_is_rejected_after_catalog_changes(catalog_file) -> None:
+    catalog, _ = agent.load_catalog_tables()
+    assert [p.id for p in catalog] == ["mug-001"]
+
+    stat = catalog_file.stat()
+    catalog_file.write_bytes(orjson.dumps([_product("cup-001", "Tea Kettle")]))
+    # Same-size edits are caught by mtime alone
+    os.utime(catalog_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    catalog, index = agent.load_catalog_tables()
+    assert [p.id for p in catalog] == ["cup-001"]
+    assert index["tea"] == {0}
+
+
+def test_last_order_sees_other_workers_appends(journal) -> None:
+    """get_last_order reflects an order another worker appended to the journal."""
+    mine = {"items": []}
+    agent.save_order(mine)
+    assert agent.last_order() is mine
+
+    with open(journal, "ab") as f:
+        f.write(b'{"id":"ord-2","items":[]}\n{"id":"ord-3","it')  # ord-3 mid-write
+
+    assert agent.last_order()["id"] == "ord-2"
+
+    with open(journal, "ab") as f:
+        f.write(b'ems":[]}\n')
+
+    assert agent.last_order()["id"] == "ord-3"
+    # Ids continue after the orders this worker only read
+    later = {"items": []}
+    agent.save_order(later)
+    assert later["id"] == "ord-4"
+
+
+@pytest.fixture
+def fresh_tables(monkeypatch):
+    """Empty the in-memory catalog tables so warm_catalog() reloads them."""
+    for name, empty in (
+        ("CATALOG", []),
+        ("CATALOG_BY_ID", {}),
+        ("INDEX", {}),
+        ("CATALOG_NAMES", []),
+    ):
+        monkeypatch.setattr(agent, name, empty)
+
+
+@pytest.fixture
+def shipped_catalog(tmp_path, monkeypatch, fresh_tables):
+    """Load the bundled catalog.json, keeping its snapshot under tmp_path."""
+    monkeypatch.setattr(agent, "CATALOG_CACHE_FILE", tmp_path / "catalog.pkl")
+    agent.warm_catalog()
+
+
+def _order_error(name: str):
+    return agent.build_order([{"name": name}]).get("error")
+
+
+def test_build_order_resolves_unique_typo(shipped_catalog) -> None:
+    order = agent.build_order([{"name": "insulated bottel", "quantity": 2}])
+
+    assert [it["product_id"] for it in order["items"]] == ["bottle-001"]
+    assert order["total_amount"] == 2 * agent.CATALOG_BY_ID["bottle-001"].price
+
+
+def test_build_order_reports_shared_word_as_ambiguous(shipped_catalog) -> None:
+    """A word found in several products is not settled by a fuzzy guess."""
+    assert _order_error("Black") == (
+        "Product 'Black' is ambiguous. Found: Black Premium Hoodie, Smart Fitness Watch"
+    )
+
+
+def test_build_order_reports_unknown_name(shipped_catalog) -> None:
+    assert _order_error("xyz") == "Product 'xyz' not found"
+
+
+def test_build_order_reports_fuzzy_near_tie_as_ambiguous(
+    catalog_file, fresh_tables
+) -> None:
+    """Two fuzzy scores within FUZZY_MARGIN of each other make the match ambiguous."""
+    catalog_file.write_bytes(
+        orjson.dumps(
+            [
+                _product("tee-001", "Blue Cotton Tee"),
+                _product("top-001", "Blue Cotton Top"),
+            ]
+        )
+    )
+    agent.warm_catalog()
+
+    scores = [
+        fuzz.WRatio("blue coton", n, processor=utils.default_process)
+        for n in agent.CATALOG_NAMES
+    ]
+    assert abs(scores[0] - scores[1]) <= agent.FUZZY_MARGIN
+    assert _order_error("blue coton") == (
+        "Product 'blue coton' is ambiguous. Found: Blue Cotton Tee, Blue Cotton Top"
+    )